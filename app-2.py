@@ -1,24 +1,213 @@
-from flask import Flask, render_template
-from flask_socketio import SocketIO, emit
+from flask import Flask, render_template, Response
+from flask_socketio import SocketIO, emit, join_room
 from flask_cors import CORS
 import cv2
 import numpy as np
 from ultralytics import YOLO
-import base64
+from ultralytics.data.augment import LetterBox
+from ultralytics.utils import ops
+import torch
+import glob
+import os
+import queue
 import threading
 import time
 from datetime import datetime
 
+try:
+    import tensorrt as trt
+    import pycuda.driver as cuda
+    from pycuda.compiler import SourceModule
+except ImportError:
+    trt = None
+    cuda = None
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+try:
+    from turbojpeg import TurboJPEG
+except ImportError:
+    TurboJPEG = None
+
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        """Run the function as plain Python when numba is not installed"""
+        return lambda func: func
+
 app = Flask(__name__)
 CORS(app)
 socketio = SocketIO(app, cors_allowed_origins="*")
 
+def put_latest(q, item):
+    """Put an item on a bounded queue, dropping the oldest item when it is full"""
+    try:
+        q.put_nowait(item)
+    except queue.Full:
+        try:
+            q.get_nowait()
+        except queue.Empty:
+            pass
+        q.put_nowait(item)
+
+@njit(cache=True)
+def layout_boxes(boxes, label_sizes):
+    """Pixel coordinates for each box: x1, y1, x2, y2, label top, label right, text baseline"""
+    layout = np.empty((boxes.shape[0], 7), dtype=np.int32)
+    for i in range(boxes.shape[0]):
+        x1 = int(boxes[i, 0])
+        y1 = int(boxes[i, 1])
+        layout[i, 0] = x1
+        layout[i, 1] = y1
+        layout[i, 2] = int(boxes[i, 2])
+        layout[i, 3] = int(boxes[i, 3])
+        layout[i, 4] = y1 - label_sizes[i, 1] - 10
+        layout[i, 5] = x1 + label_sizes[i, 0]
+        layout[i, 6] = y1 - 5
+    return layout
+
+class CalibrationFrames:
+    """Feed frames saved from the camera to a TensorRT INT8 calibrator"""
+    def __init__(self, calib_dir, preprocess, cache_file, batch_size=8):
+        super().__init__()
+        files = sorted(glob.glob(os.path.join(calib_dir, '*.jpg')))
+        # The calibration profile has a fixed batch, so a trailing partial batch can't be used
+        self.files = files[:len(files) - len(files) % batch_size]
+        if len(self.files) < len(files):
+            print(f"Skipping {len(files) - len(self.files)} calibration frames that don't fill a batch of {batch_size}")
+        self.preprocess = preprocess
+        self.cache_file = cache_file
+        self.batch_size = batch_size
+        self.index = 0
+        self.device_input = None
+    
+    def get_batch_size(self):
+        return self.batch_size
+    
+    def get_batch(self, names):
+        if self.index + self.batch_size > len(self.files):
+            return None
+        batch = np.concatenate([self.preprocess(cv2.imread(f))
+                                for f in self.files[self.index:self.index + self.batch_size]])
+        self.index += self.batch_size
+        if self.device_input is None:
+            self.device_input = cuda.mem_alloc(batch.nbytes)
+        cuda.memcpy_htod(self.device_input, batch)
+        return [int(self.device_input)]
+    
+    def read_calibration_cache(self):
+        if os.path.exists(self.cache_file):
+            with open(self.cache_file, 'rb') as f:
+                return f.read()
+        return None
+    
+    def write_calibration_cache(self, cache):
+        with open(self.cache_file, 'wb') as f:
+            f.write(cache)
+
+if trt is not None:
+    class EntropyCalibrator(CalibrationFrames, trt.IInt8EntropyCalibrator2):
+        pass
+    
+    # MinMax keeps the full activation range and can beat entropy calibration on some models
+    class MinMaxCalibrator(CalibrationFrames, trt.IInt8MinMaxCalibrator):
+        pass
+
+# Hardware JPEG decode on Jetson, pass as gst_pipeline to YOLODetectionSystem
+GST_PIPELINE = ("v4l2src device=/dev/video0 ! image/jpeg,width=1280,height=720,framerate=30/1 ! "
+                "nvjpegdec ! nvvidconv ! video/x-raw,format=BGRx ! videoconvert ! "
+                "video/x-raw,format=BGR ! appsink drop=true max-buffers=1")
+
+# Fused letterbox resize + BGR -> RGB + /255 + HWC -> NCHW, one thread per output pixel
+LETTERBOX_KERNEL = """
+#include <cuda_fp16.h>
+
+template <typename T>
+__device__ void letterbox(const unsigned char* src, T* dst, int src_w, int src_h, int size,
+                          int new_w, int new_h, int left, int top, float scale_x, float scale_y)
+{
+    int x = blockIdx.x * blockDim.x + threadIdx.x;
+    int y = blockIdx.y * blockDim.y + threadIdx.y;
+    int b = blockIdx.z;
+    if (x >= size || y >= size) return;
+
+    const unsigned char* img = src + (size_t)b * src_h * src_w * 3;
+    float c0 = 114.0f, c1 = 114.0f, c2 = 114.0f;
+    int ix = x - left, iy = y - top;
+    if (ix >= 0 && ix < new_w && iy >= 0 && iy < new_h) {
+        // Bilinear sample with half-pixel centers, as cv2.INTER_LINEAR
+        float sx = fminf(fmaxf((ix + 0.5f) * scale_x - 0.5f, 0.0f), src_w - 1.0f);
+        float sy = fminf(fmaxf((iy + 0.5f) * scale_y - 0.5f, 0.0f), src_h - 1.0f);
+        int x0 = (int)sx, y0 = (int)sy;
+        int x1 = min(x0 + 1, src_w - 1), y1 = min(y0 + 1, src_h - 1);
+        float ax = sx - x0, ay = sy - y0;
+        const unsigned char* p00 = img + (y0 * src_w + x0) * 3;
+        const unsigned char* p01 = img + (y0 * src_w + x1) * 3;
+        const unsigned char* p10 = img + (y1 * src_w + x0) * 3;
+        const unsigned char* p11 = img + (y1 * src_w + x1) * 3;
+        c0 = (1 - ay) * ((1 - ax) * p00[0] + ax * p01[0]) + ay * ((1 - ax) * p10[0] + ax * p11[0]);
+        c1 = (1 - ay) * ((1 - ax) * p00[1] + ax * p01[1]) + ay * ((1 - ax) * p10[1] + ax * p11[1]);
+        c2 = (1 - ay) * ((1 - ax) * p00[2] + ax * p01[2]) + ay * ((1 - ax) * p10[2] + ax * p11[2]);
+    }
+
+    size_t plane = (size_t)size * size;
+    T* out = dst + (size_t)b * 3 * plane + (size_t)y * size + x;
+    out[0] = (T)(c2 / 255.0f);
+    out[plane] = (T)(c1 / 255.0f);
+    out[2 * plane] = (T)(c0 / 255.0f);
+}
+
+extern "C" __global__ void letterbox_f32(const unsigned char* src, float* dst, int src_w, int src_h, int size,
+                                         int new_w, int new_h, int left, int top, float scale_x, float scale_y)
+{
+    letterbox<float>(src, dst, src_w, src_h, size, new_w, new_h, left, top, scale_x, scale_y);
+}
+
+extern "C" __global__ void letterbox_f16(const unsigned char* src, __half* dst, int src_w, int src_h, int size,
+                                         int new_w, int new_h, int left, int top, float scale_x, float scale_y)
+{
+    letterbox<__half>(src, dst, src_w, src_h, size, new_w, new_h, left, top, scale_x, scale_y);
+}
+"""
+
 class YOLODetectionSystem:
-    def __init__(self, model_path="oppo.pt"):
-        self.model = YOLO(model_path)
+    def __init__(self, model_path="oppo.pt", imgsz=1280, precision="fp16",
+                 calibrator="entropy", calib_dir="calib", batch_size=4, max_batch=8, gst_pipeline=None,
+                 source=0):
+        self.model = YOLO(model_path)  # kept for class names and as PyTorch fallback
+        self.model_path = model_path
+        self.gst_pipeline = gst_pipeline  # e.g. GST_PIPELINE, None for the default capture
+        self.source = source  # camera index, or a video file path (paced to its frame rate)
+        self.names = self.model.names
+        self.num_names = len(self.names)
+        self.sg_class_id = next((i for i, n in self.names.items() if n.lower() == 'sg'), -1)
+        self.label_size_cache = {}  # label -> (width, height), labels repeat per class/confidence
+        self.status_bar = np.zeros((35, 1275, 3), dtype=np.uint8)  # black bar behind the status text
+        # Compile the numba layout helper now rather than on the first frame with detections
+        layout_boxes(np.zeros((0, 4), dtype=np.float32), np.zeros((0, 2), dtype=np.int32))
+        self.imgsz = imgsz
+        self.batch_size = batch_size  # frames per inference call
+        self.max_batch = max_batch  # largest batch the engine is built for
+        self.precision = precision  # 'fp16' or 'int8'
+        self.calibrator = calibrator  # 'entropy' or 'minmax', INT8 only
+        self.calib_dir = calib_dir
+        self.calib_batch = 8  # frames per INT8 calibration batch
+        self.letterbox = LetterBox(new_shape=(imgsz, imgsz), auto=False)
+        # Backends are set up on the first start, not at import, so the debug reloader's
+        # watcher process never holds a CUDA context or builds an engine
+        self.backend_ready = False
+        self.cuda_ctx = None
+        self.engine = None
+        self.context = None
+        self.session = None
         self.camera = None
         self.is_running = False
-        self.current_frame = None
+        self.current_frame = None  # latest frame by reference, use snapshot() to read it
+        self.frame_lock = threading.Lock()
         self.detection_results = {
             'has_sg': False,
             'detections': [],
@@ -26,69 +215,369 @@ class YOLODetectionSystem:
             'stats': {'total': 0, 'pass': 0, 'ng': 0}
         }
         self.fps_counter = 0
-        self.fps_start_time = time.time()
+        self.fps_start_time = time.monotonic()
+        self.last_detection_time = 0.0
+        self.frame_id = 0
+        self.capture_queue = None
+        self.encode_queue = None
+        self.emit_queue = None
+        self.threads = []
+        self.pace_capture = False
+        self.latest_jpeg = (None, None)  # (frame_id, jpeg bytes) served on /video
+        self.last_emitted_result = None
+        self.last_emit_time = 0.0
+        self.frame_ready = threading.Condition()
+        self.jpeg = None
+        if TurboJPEG is not None:
+            try:
+                self.jpeg = TurboJPEG()
+            except Exception as e:
+                print(f"Error loading libjpeg-turbo, using OpenCV JPEG encoder: {e}")
+        
+    def setup_backend(self):
+        """Load the TensorRT engine, or ONNX Runtime on CPU-only machines, PyTorch otherwise"""
+        self.backend_ready = True
+        if trt is not None:
+            try:
+                self.trt_logger = trt.Logger(trt.Logger.WARNING)
+                trt.init_libnvinfer_plugins(self.trt_logger, "")  # registers EfficientNMS_TRT
+                cuda.init()
+                self.cuda_ctx = cuda.Device(0).make_context()
+                self.cuda_ctx.pop()
+                self.setup_engine()
+            except Exception as e:
+                print(f"Error loading TensorRT engine, using PyTorch: {e}")
+                self.engine = None
+                self.context = None
+                # Drop the context too, so threads don't push it and INT8 doesn't retry the build
+                if self.cuda_ctx is not None:
+                    self.cuda_ctx.detach()
+                    self.cuda_ctx = None
+        if self.context is None and ort is not None and not torch.cuda.is_available():
+            try:
+                self.setup_onnx()
+            except Exception as e:
+                print(f"Error loading ONNX Runtime session, using PyTorch: {e}")
+                self.session = None
+    
+    def setup_engine(self):
+        """Build (once) and load the TensorRT engine for the configured precision"""
+        # Every setting baked into the engine is part of its name so a stale engine is never reused
+        precision = f"int8_{self.calibrator}" if self.precision == "int8" else self.precision
+        engine_path = (f"{os.path.splitext(self.model_path)[0]}_{precision}_{self.imgsz}"
+                       f"_b{self.max_batch}_nms.engine")
+        if not os.path.exists(engine_path):
+            if self.precision == "int8" and not glob.glob(os.path.join(self.calib_dir, '*.jpg')):
+                print(f"No calibration frames in {self.calib_dir}, INT8 engine will be built "
+                      f"after recording frames in initialize_camera")
+                return
+            self.build_engine(engine_path)
+        self.load_engine(engine_path)
+    
+    def build_engine(self, engine_path):
+        """Build an FP16 or INT8 TensorRT engine from an ONNX export, with NMS inside the engine"""
+        onnx_path = YOLO(self.model_path).export(format="onnx", imgsz=self.imgsz, dynamic=True)
+        builder = trt.Builder(self.trt_logger)
+        network = builder.create_network(1 << int(trt.NetworkDefinitionCreationFlag.EXPLICIT_BATCH))
+        parser = trt.OnnxParser(network, self.trt_logger)
+        if not parser.parse_from_file(onnx_path):
+            raise RuntimeError(f"Failed to parse {onnx_path}: {parser.get_error(0)}")
+        nms_weights = self.add_nms(network)  # TensorRT reads constant weights at build time
         
-    def initialize_camera(self, camera_index=0):
-        """Initialize camera"""
+        config = builder.create_builder_config()
+        config.set_memory_pool_limit(trt.MemoryPoolType.WORKSPACE, 4 << 30)
+        config.set_flag(trt.BuilderFlag.FP16)  # with INT8, layers without INT8 kernels fall back to FP16
+        
+        shape = (3, self.imgsz, self.imgsz)
+        profile = builder.create_optimization_profile()
+        profile.set_shape(network.get_input(0).name, (1, *shape),
+                          (self.batch_size, *shape), (self.max_batch, *shape))
+        config.add_optimization_profile(profile)
+        
+        self.cuda_ctx.push()
+        try:
+            if self.precision == "int8":
+                config.set_flag(trt.BuilderFlag.INT8)
+                # TensorRT calibrates at the profile's opt shape, so give calibration a fixed-batch
+                # profile that matches what the calibrator uploads
+                calib_profile = builder.create_optimization_profile()
+                calib_profile.set_shape(network.get_input(0).name, *[(self.calib_batch, *shape)] * 3)
+                config.set_calibration_profile(calib_profile)
+                calibrator_cls = MinMaxCalibrator if self.calibrator == "minmax" else EntropyCalibrator
+                cache_file = os.path.join(self.calib_dir, f"{self.calibrator}.cache")
+                config.int8_calibrator = calibrator_cls(self.calib_dir, self.preprocess, cache_file,
+                                                        batch_size=self.calib_batch)
+            serialized = builder.build_serialized_network(network, config)
+        finally:
+            self.cuda_ctx.pop()
+        del nms_weights
+        if serialized is None:
+            raise RuntimeError(f"Failed to build {self.precision.upper()} TensorRT engine")
+        with open(engine_path, 'wb') as f:
+            f.write(serialized)
+    
+    def add_nms(self, network):
+        """Replace the raw YOLO output with EfficientNMS_TRT outputs: num_dets, boxes, scores, classes"""
+        output = network.get_output(0)  # (B, 4 + classes, anchors), boxes as cx, cy, w, h
+        network.unmark_output(output)
+        transpose = network.add_shuffle(output)
+        transpose.second_transpose = (0, 2, 1)
+        pred = transpose.get_output(0)  # (B, anchors, 4 + classes)
+        
+        # The batch is dynamic, so slice sizes are built from the runtime shape
+        weights = []
+        batch_anchors = network.add_slice(network.add_shape(pred).get_output(0), (0,), (2,), (1,)).get_output(0)
+        
+        def channel_slice(start, channels):
+            weights.append(np.array([channels], dtype=np.int32))
+            size = network.add_concatenation(
+                [batch_anchors, network.add_constant((1,), weights[-1]).get_output(0)]).get_output(0)
+            layer = network.add_slice(pred, (0, 0, start), (1, 1, channels), (1, 1, 1))
+            layer.set_input(2, size)
+            return layer.get_output(0)
+        
+        boxes = channel_slice(0, 4)
+        scores = channel_slice(4, self.num_names)
+        
+        fields = trt.PluginFieldCollection([
+            trt.PluginField("background_class", np.array([-1], dtype=np.int32), trt.PluginFieldType.INT32),
+            trt.PluginField("max_output_boxes", np.array([300], dtype=np.int32), trt.PluginFieldType.INT32),
+            trt.PluginField("score_threshold", np.array([0.5], dtype=np.float32), trt.PluginFieldType.FLOAT32),
+            trt.PluginField("iou_threshold", np.array([0.7], dtype=np.float32), trt.PluginFieldType.FLOAT32),
+            trt.PluginField("box_coding", np.array([1], dtype=np.int32), trt.PluginFieldType.INT32),  # cx, cy, w, h
+            trt.PluginField("score_activation", np.array([0], dtype=np.int32), trt.PluginFieldType.INT32),
+        ])
+        creator = trt.get_plugin_registry().get_plugin_creator("EfficientNMS_TRT", "1")
+        nms = network.add_plugin_v2([boxes, scores], creator.create_plugin("efficient_nms", fields))
+        for i, name in enumerate(("num_dets", "det_boxes", "det_scores", "det_classes")):
+            nms.get_output(i).name = name
+            network.mark_output(nms.get_output(i))
+        return weights
+    
+    def load_engine(self, engine_path):
+        """Load TensorRT engine and allocate its input/output buffers"""
+        self.cuda_ctx.push()
         try:
-            self.camera = cv2.VideoCapture(camera_index)
+            with open(engine_path, 'rb') as f:
+                runtime = trt.Runtime(self.trt_logger)
+                self.engine = runtime.deserialize_cuda_engine(f.read())
+            self.context = self.engine.create_execution_context()
+            # Size buffers for the largest batch the engine accepts, smaller batches use a prefix
+            self.engine_batch = self.engine.get_profile_shape(0, 0)[2][0]
+            input_shape = (self.engine_batch, 3, self.imgsz, self.imgsz)
+            self.context.set_binding_shape(0, input_shape)
+            input_dtype = trt.nptype(self.engine.get_binding_dtype(0))
+            
+            # Device buffers and pinned host memory are allocated once and reused for every batch,
+            # pinned memory lets the async copies run as real DMA on the stream
+            self.stream = cuda.Stream()
+            self.d_input = cuda.mem_alloc(int(np.prod(input_shape)) * np.dtype(input_dtype).itemsize)
+            self.h_outputs = []
+            self.d_outputs = []
+            for i in range(1, self.engine.num_bindings):
+                host = cuda.pagelocked_empty(tuple(self.context.get_binding_shape(i)),
+                                             trt.nptype(self.engine.get_binding_dtype(i)))
+                self.h_outputs.append(host)
+                self.d_outputs.append(cuda.mem_alloc(host.nbytes))
+            
+            kernels = SourceModule(LETTERBOX_KERNEL, no_extern_c=True)
+            half = input_dtype == np.float16
+            self.letterbox_kernel = kernels.get_function("letterbox_f16" if half else "letterbox_f32")
+            self.h_frames = None  # raw uint8 frames, allocated once the frame size is known
+            self.d_frames = None
+        finally:
+            self.cuda_ctx.pop()
+    
+    def preprocess(self, frame):
+        """Letterbox, BGR -> RGB, HWC -> CHW, 0-255 -> 0.0-1.0"""
+        img = self.letterbox(image=frame)
+        img = img[..., ::-1].transpose(2, 0, 1)[None]
+        return np.ascontiguousarray(img, dtype=np.float32) / 255.0
+    
+    def allocate_frame_buffers(self, width, height):
+        """Allocate pinned host and device buffers for a batch of raw camera frames"""
+        self.cuda_ctx.push()
+        try:
+            self.h_frames = cuda.pagelocked_empty((self.engine_batch, height, width, 3), np.uint8)
+            self.d_frames = cuda.mem_alloc(self.h_frames.nbytes)
+        finally:
+            self.cuda_ctx.pop()
+    
+    def setup_onnx(self):
+        """Export the model to ONNX once and run it with OpenVINO on CPU-only machines"""
+        onnx_path = os.path.splitext(self.model_path)[0] + ".onnx"
+        if not os.path.exists(onnx_path):
+            onnx_path = YOLO(self.model_path).export(format="onnx", opset=12, simplify=True,
+                                                     imgsz=self.imgsz, dynamic=True)
+        providers = [('OpenVINOExecutionProvider', {'device_type': 'CPU_FP32'}), 'CPUExecutionProvider']
+        available = ort.get_available_providers()
+        providers = [p for p in providers if (p[0] if isinstance(p, tuple) else p) in available]
+        self.session = ort.InferenceSession(onnx_path, providers=providers)
+        self.session_input = self.session.get_inputs()[0].name
+    
+    def detect(self, frames):
+        """Run YOLO on a batch of frames, returns an (N, 6) x1, y1, x2, y2, conf, cls array per frame"""
+        if self.context is not None:
+            num_dets, boxes, scores, classes = self.infer_engine(frames)
+            detections = []
+            for i, frame in enumerate(frames):
+                num = int(num_dets[i, 0])
+                det = np.empty((num, 6), dtype=np.float32)
+                det[:, :4] = ops.scale_boxes((self.imgsz, self.imgsz), boxes[i, :num].astype(np.float32), frame.shape)
+                det[:, 4] = scores[i, :num]
+                det[:, 5] = classes[i, :num]
+                detections.append(det)
+            return detections
+        
+        if self.session is None:
+            return [result.boxes.data.cpu().numpy() for result in self.model(frames, conf=0.5)]
+        
+        preds = ops.non_max_suppression(torch.from_numpy(self.infer_onnx(frames)), conf_thres=0.5)
+        for frame, pred in zip(frames, preds):
+            pred[:, :4] = ops.scale_boxes((self.imgsz, self.imgsz), pred[:, :4], frame.shape)
+        return [pred.numpy() for pred in preds]
+    
+    def infer_onnx(self, frames):
+        """Run the ONNX Runtime session, returns the raw model output"""
+        batch = np.concatenate([self.preprocess(frame) for frame in frames])
+        return self.session.run(None, {self.session_input: batch})[0]
+    
+    def infer_engine(self, frames):
+        """Run the TensorRT engine, returns its num_dets, boxes, scores and classes outputs"""
+        batch = len(frames)
+        
+        # Stage raw frames in pinned memory, upload and preprocess on the GPU into the engine input
+        h, w = frames[0].shape[:2]
+        if self.h_frames is None or self.h_frames.shape[1:3] != (h, w):
+            self.allocate_frame_buffers(w, h)
+        for i, frame in enumerate(frames):
+            np.copyto(self.h_frames[i], frame)
+        cuda.memcpy_htod_async(self.d_frames, self.h_frames[:batch], self.stream)
+        
+        # Same geometry as Ultralytics LetterBox so scale_boxes maps boxes back
+        size = self.imgsz
+        r = min(size / h, size / w)
+        new_w, new_h = int(round(w * r)), int(round(h * r))
+        left = int(round((size - new_w) / 2 - 0.1))
+        top = int(round((size - new_h) / 2 - 0.1))
+        self.letterbox_kernel(self.d_frames, self.d_input, np.int32(w), np.int32(h), np.int32(size),
+                              np.int32(new_w), np.int32(new_h), np.int32(left), np.int32(top),
+                              np.float32(w / new_w), np.float32(h / new_h),
+                              block=(32, 8, 1), grid=((size + 31) // 32, (size + 7) // 8, batch),
+                              stream=self.stream)
+        
+        self.context.set_binding_shape(0, (batch, 3, self.imgsz, self.imgsz))
+        bindings = [int(self.d_input)] + [int(d_output) for d_output in self.d_outputs]
+        self.context.execute_async_v2(bindings, self.stream.handle)
+        for h_output, d_output in zip(self.h_outputs, self.d_outputs):
+            cuda.memcpy_dtoh_async(h_output[:batch], d_output, self.stream)
+        self.stream.synchronize()
+        return [h_output[:batch] for h_output in self.h_outputs]
+    
+    def record_calibration_frames(self, num_frames):
+        """Save camera frames to calib_dir for INT8 calibration"""
+        os.makedirs(self.calib_dir, exist_ok=True)
+        saved = 0
+        while saved < num_frames:
+            ret, frame = self.camera.read()
+            if not ret:
+                break
+            cv2.imwrite(os.path.join(self.calib_dir, f"{saved:04d}.jpg"), frame)
+            saved += 1
+        return saved
+    
+    def encode_jpeg(self, frame, quality=85):
+        """Encode a BGR frame to JPEG bytes, with libjpeg-turbo when available"""
+        if self.jpeg is not None:
+            return self.jpeg.encode(frame, quality=quality)
+        ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        return buffer.tobytes() if ret else None
+    
+    def initialize_camera(self, camera_index=0, calib_frames=300, gst_pipeline=None):
+        """Initialize camera, recording calibration frames first if the INT8 engine is missing"""
+        try:
+            self.camera = None
+            if gst_pipeline:
+                self.camera = cv2.VideoCapture(gst_pipeline, cv2.CAP_GSTREAMER)
+                if not self.camera.isOpened():
+                    print("Error opening GStreamer pipeline, using default capture")
+                    self.camera = None
+            if self.camera is None:
+                self.camera = cv2.VideoCapture(camera_index)
+                # Ask for MJPG so the camera doesn't send raw YUYV that needs a colorspace conversion,
+                # FOURCC has to be set before the resolution on most V4L2 drivers
+                self.camera.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
             self.camera.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
             self.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
             self.camera.set(cv2.CAP_PROP_FPS, 30)
-            return True
+            # Live cameras block in read() at their frame rate, video files have to be paced
+            self.pace_capture = isinstance(camera_index, str) and not gst_pipeline
         except Exception as e:
             print(f"Error initializing camera: {e}")
             return False
+        
+        if self.precision == "int8" and self.context is None and self.cuda_ctx is not None and calib_frames:
+            try:
+                saved = self.record_calibration_frames(calib_frames)
+                print(f"Recorded {saved} calibration frames to {self.calib_dir}")
+                self.setup_engine()
+            except Exception as e:
+                print(f"Error building INT8 engine, using PyTorch: {e}")
+                self.engine = None
+                self.context = None
+        
+        if self.context is not None:
+            self.allocate_frame_buffers(int(self.camera.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                                        int(self.camera.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        return True
     
-    def process_detections(self, results, frame):
-        """Process YOLO detection results"""
+    def process_detections(self, boxes, frame):
+        """Process YOLO detections, an (N, 6) array of x1, y1, x2, y2, conf, cls"""
         has_sg = False
         detections = []
         
-        if results and len(results) > 0 and results[0].boxes is not None:
-            boxes = results[0].boxes
+        if len(boxes) > 0:
+            data = boxes[boxes[:, 4] >= 0.5]
+            class_ids = data[:, 5].astype(int)
             
-            for i, box in enumerate(boxes):
-                bbox = box.xyxy[0].cpu().numpy()
-                confidence = float(box.conf[0].cpu().numpy())
-                class_id = int(box.cls[0].cpu().numpy())
-                
-                class_name = self.model.names[class_id] if class_id < len(self.model.names) else f"Class_{class_id}"
-                
-                detection_info = {
-                    'class': class_name,
-                    'confidence': confidence,
-                    'bbox': bbox.tolist()
-                }
-                detections.append(detection_info)
-                
-                if class_name.lower() == 'sg':
-                    has_sg = True
-                
-                x1, y1, x2, y2 = bbox.astype(int)
-                if class_name.lower() == 'sg':
-                    color = (0, 0, 255)  # Red for SG (NG)
-                    status = "SG - DEFECT"
-                else:
-                    color = (0, 255, 255)  # Yellow for other objects
-                    status = class_name.upper()
-                
-                cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
-                label = f"{status} {confidence:.2f}"
-                label_size = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)[0]
-                cv2.rectangle(frame, (x1, y1 - label_size[1] - 10), 
-                            (x1 + label_size[0], y1), color, -1)
-                cv2.putText(frame, label, (x1, y1 - 5), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+            class_names = [self.names[c] if c < self.num_names else f"Class_{c}" for c in class_ids]
+            detections = [{'class': name, 'confidence': float(row[4]), 'bbox': row[:4].tolist()}
+                          for name, row in zip(class_names, data)]
+            sg_mask = class_ids == self.sg_class_id
+            has_sg = bool(sg_mask.any())
+            
+            # Draw each group with a fixed color, SG last so defects stay on top
+            other_labels = [f"{name.upper()} {row[4]:.2f}"
+                            for name, row, is_sg in zip(class_names, data, sg_mask) if not is_sg]
+            self.draw_boxes(frame, data[~sg_mask], other_labels, (0, 255, 255))  # Yellow for other objects
+            sg_labels = [f"SG - DEFECT {conf:.2f}" for conf in data[sg_mask, 4]]
+            self.draw_boxes(frame, data[sg_mask], sg_labels, (0, 0, 255))  # Red for SG (NG)
         
         return has_sg, detections, frame
     
-    def update_statistics(self, has_sg):
+    def draw_boxes(self, frame, boxes, labels, color):
+        """Draw labelled boxes in a single color"""
+        if not labels:
+            return
+        # Coordinates are computed in compiled code, only the cv2 calls stay in Python
+        label_sizes = np.array([self.text_size(label) for label in labels], dtype=np.int32)
+        layout = layout_boxes(np.ascontiguousarray(boxes[:, :4], dtype=np.float32), label_sizes)
+        for (x1, y1, x2, y2, label_top, label_right, text_y), label in zip(layout.tolist(), labels):
+            cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2, cv2.LINE_4)
+            cv2.rectangle(frame, (x1, label_top), (label_right, y1), color, -1, cv2.LINE_4)
+            cv2.putText(frame, label, (x1, text_y), 
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+    
+    def text_size(self, label):
+        """Cached cv2.getTextSize for box labels"""
+        size = self.label_size_cache.get(label)
+        if size is None:
+            size = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)[0]
+            self.label_size_cache[label] = size
+        return size
+    
+    def update_statistics(self, has_sg, current_time):
         """Update production statistics"""
-        current_time = time.time()
-        if not hasattr(self, 'last_detection_time'):
-            self.last_detection_time = 0
-        
         if current_time - self.last_detection_time > 3.0:
             self.detection_results['stats']['total'] += 1
             if has_sg:
@@ -97,75 +586,178 @@ class YOLODetectionSystem:
                 self.detection_results['stats']['pass'] += 1
             self.last_detection_time = current_time
     
-    def calculate_fps(self):
+    def calculate_fps(self, current_time):
         """Calculate FPS"""
         self.fps_counter += 1
-        current_time = time.time()
         if current_time - self.fps_start_time >= 1.0:
             self.detection_results['fps'] = self.fps_counter
             self.fps_counter = 0
             self.fps_start_time = current_time
     
-    def generate_frames(self):
-        """Generate video frames with detections"""
+    def capture_loop(self):
+        """Read camera frames into the capture queue"""
+        frame_interval = 1.0 / (self.camera.get(cv2.CAP_PROP_FPS) or 30) if self.pace_capture else 0
+        next_deadline = time.monotonic()
         while self.is_running and self.camera is not None:
             ret, frame = self.camera.read()
             if not ret:
+                self.is_running = False
                 break
+            # Tag frames with an increasing id to keep emit order
+            put_latest(self.capture_queue, (self.frame_id, frame))
+            self.frame_id += 1
             
-            try:
-                results = self.model(frame, conf=0.5)
-                has_sg, detections, processed_frame = self.process_detections(results, frame)
-                
-                self.detection_results['has_sg'] = has_sg
-                self.detection_results['detections'] = detections
-                self.update_statistics(has_sg)
-                self.calculate_fps()
-                
-                status_color = (0, 0, 255) if has_sg else (0, 255, 0)
-                status_text = f"FPS: {self.detection_results['fps']} | Status: {'NG - SG DETECTED' if has_sg else 'PASS - NO DEFECTS'}"
-                overlay = processed_frame.copy()
-                cv2.rectangle(overlay, (5, 5), (len(status_text) * 12 + 10, 40), (0, 0, 0), -1)
-                cv2.addWeighted(overlay, 0.7, processed_frame, 0.3, 0, processed_frame)
-                cv2.putText(processed_frame, status_text, (10, 30), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.7, status_color, 2)
-                
-                self.current_frame = processed_frame.copy()
+            if frame_interval:
+                # Sleep to an absolute deadline so processing time doesn't add drift
+                next_deadline += frame_interval
+                time.sleep(max(0.0, next_deadline - time.monotonic()))
+    
+    def inference_loop(self):
+        """Run batched inference on captured frames"""
+        # CUDA contexts are bound to a thread, make the engine's current here
+        if self.cuda_ctx is not None:
+            self.cuda_ctx.push()
+        try:
+            while self.is_running:
+                try:
+                    batch = [self.capture_queue.get(timeout=0.1)]
+                except queue.Empty:
+                    continue
+                # Batch whatever else was captured while the previous batch ran
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append(self.capture_queue.get_nowait())
+                    except queue.Empty:
+                        break
                 
-                # Encode frame to base64 for Socket.IO
-                ret, buffer = cv2.imencode('.jpg', self.current_frame, 
-                                        [cv2.IMWRITE_JPEG_QUALITY, 85])
-                if ret:
-                    frame_bytes = base64.b64encode(buffer).decode('utf-8')
-                    
-                    # Emit detection results and frame
-                    socketio.emit('detection_result', {
-                        'status': 'NG' if has_sg else 'PASS',
-                        'pass_count': self.detection_results['stats']['pass'],
-                        'ng_count': self.detection_results['stats']['ng'],
-                        'total_count': self.detection_results['stats']['total'],
-                        'ng_rate': round((self.detection_results['stats']['ng'] / 
-                                       max(1, self.detection_results['stats']['total']) * 100), 1)
-                    })
-                    socketio.emit('video_frame', {'frame': frame_bytes})
+                frame_ids, frames = zip(*batch)
+                try:
+                    batch_results = self.detect(list(frames))
+                except Exception as e:
+                    print(f"Detection error: {e}")
+                    with self.frame_lock:
+                        self.current_frame = frames[-1]
+                    continue
+                put_latest(self.encode_queue, (frame_ids, frames, batch_results))
+        finally:
+            if self.cuda_ctx is not None:
+                self.cuda_ctx.pop()
+    
+    def encode_loop(self):
+        """Draw, encode and emit frames in capture order"""
+        while self.is_running:
+            try:
+                frame_ids, frames, batch_results = self.encode_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            for frame_id, frame, boxes in zip(frame_ids, frames, batch_results):
+                self.emit_frame(frame_id, frame, boxes)
+    
+    def emit_frame(self, frame_id, frame, boxes):
+        """Draw detections on a frame and emit it with the detection results"""
+        try:
+            has_sg, detections, processed_frame = self.process_detections(boxes, frame)
             
-            except Exception as e:
-                print(f"Detection error: {e}")
-                self.current_frame = frame.copy()
+            self.detection_results['has_sg'] = has_sg
+            self.detection_results['detections'] = detections
+            # One monotonic timestamp per frame, unaffected by wall-clock adjustments
+            now = time.monotonic()
+            self.update_statistics(has_sg, now)
+            self.calculate_fps(now)
+            
+            status_color = (0, 0, 255) if has_sg else (0, 255, 0)
+            status_text = f"FPS: {self.detection_results['fps']} | Status: {'NG - SG DETECTED' if has_sg else 'PASS - NO DEFECTS'}"
+            # Blend the fixed-size status bar in place on its ROI, no per-frame allocation
+            roi = processed_frame[5:40, 5:1280]
+            cv2.addWeighted(self.status_bar[:, :roi.shape[1]], 0.7, roi, 0.3, 0, roi)
+            cv2.putText(processed_frame, status_text, (10, 30), 
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, status_color, 2)
             
-            time.sleep(0.033)  # ~30 FPS
+            # Frames are not reused after this point, so keep a reference instead of a copy
+            with self.frame_lock:
+                self.current_frame = processed_frame
+            
+            buffer = self.encode_jpeg(processed_frame)
+            if buffer is not None:
+                with self.frame_ready:
+                    self.latest_jpeg = (frame_id, buffer)
+                    self.frame_ready.notify_all()
+                
+                # Frames are served over /video, only the results go through Socket.IO
+                self.emit_result({
+                    'status': 'NG' if has_sg else 'PASS',
+                    'pass_count': self.detection_results['stats']['pass'],
+                    'ng_count': self.detection_results['stats']['ng'],
+                    'total_count': self.detection_results['stats']['total'],
+                    'ng_rate': round((self.detection_results['stats']['ng'] / 
+                                   max(1, self.detection_results['stats']['total']) * 100), 1)
+                }, now)
+        
+        except Exception as e:
+            print(f"Detection error: {e}")
+            with self.frame_lock:
+                self.current_frame = frame
+    
+    def snapshot(self):
+        """Return a copy of the latest frame, or None before the first frame"""
+        with self.frame_lock:
+            return self.current_frame.copy() if self.current_frame is not None else None
+    
+    def emit_result(self, result, now, min_interval=0.5):
+        """Emit detection results when they change, or at most every min_interval seconds otherwise"""
+        if result == self.last_emitted_result and now - self.last_emit_time < min_interval:
+            return
+        put_latest(self.emit_queue, result)
+        self.last_emitted_result = result
+        self.last_emit_time = now
+    
+    def emit_loop(self):
+        """Send queued detection results to the viewers room"""
+        while self.is_running:
+            try:
+                result = self.emit_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            socketio.emit('detection_result', result, to='viewers')
+    
+    def mjpeg_stream(self):
+        """Yield encoded frames as a multipart MJPEG stream, waiting while detection is stopped"""
+        last_id = None
+        while True:
+            with self.frame_ready:
+                # latest_jpeg is reset to (None, None) on start, never stream that placeholder
+                if not self.frame_ready.wait_for(
+                        lambda: self.latest_jpeg[0] is not None and self.latest_jpeg[0] != last_id, timeout=1.0):
+                    continue
+                last_id, buffer = self.latest_jpeg
+            yield b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + buffer + b'\r\n'
     
     def start_detection(self):
         """Start detection system"""
-        if self.initialize_camera():
+        if not self.backend_ready:
+            self.setup_backend()
+        if self.initialize_camera(self.source, gst_pipeline=self.gst_pipeline):
             self.is_running = True
-            threading.Thread(target=self.generate_frames, daemon=True).start()
+            with self.frame_ready:
+                self.latest_jpeg = (None, None)
+            self.capture_queue = queue.Queue(maxsize=max(2, self.batch_size))
+            self.encode_queue = queue.Queue(maxsize=2)
+            self.emit_queue = queue.Queue(maxsize=2)
+            self.threads = [threading.Thread(target=target, daemon=True)
+                            for target in (self.capture_loop, self.inference_loop, self.encode_loop)]
+            for thread in self.threads:
+                thread.start()
+            # Emits run as a Socket.IO background task so a slow client never stalls encoding
+            socketio.start_background_task(self.emit_loop)
             return True
         return False
     
     def stop_detection(self):
         """Stop detection system"""
         self.is_running = False
+        for thread in self.threads:
+            thread.join(timeout=1.0)
+        self.threads = []
         if self.camera:
             self.camera.release()
             self.camera = None
@@ -290,6 +882,9 @@ def index():
         const totalCount = document.getElementById('totalCount');
         const ngRate = document.getElementById('ngRate');
 
+        // The stream waits for frames while detection is stopped, so every viewer gets video
+        videoFeed.src = '/video';
+
         function updateButtonStates(isRunning) {
             startBtn.disabled = isRunning;
             stopBtn.disabled = !isRunning;
@@ -314,7 +909,9 @@ def index():
 
         socket.on('system_status', (data) => {
             updateButtonStates(data.is_running);
-            if (!data.is_running) {
+            if (data.is_running) {
+                videoFeed.src = '/video?t=' + Date.now();
+            } else {
                 videoFeed.src = '';
                 detectionBanner.className = 'detection-banner rounded-lg shadow-lg mb-6 py-8 text-center no-detection-bg';
                 detectionStatus.textContent = 'NO DETECTION';
@@ -322,10 +919,6 @@ def index():
             }
         });
 
-        socket.on('video_frame', (data) => {
-            videoFeed.src = 'data:image/jpeg;base64,' + data.frame;
-        });
-
         socket.on('detection_result', (data) => {
             if (data.status === 'PASS') {
                 detectionBanner.className = 'detection-banner rounded-lg shadow-lg mb-6 py-8 text-center pass-bg';
@@ -351,6 +944,15 @@ def index():
 </html>
     '''
 
+@app.route('/video')
+def video():
+    """MJPEG video stream"""
+    return Response(detector.mjpeg_stream(), mimetype='multipart/x-mixed-replace; boundary=frame')
+
+@socketio.on('connect')
+def handle_connect():
+    join_room('viewers')
+
 @socketio.on('start_detection')
 def handle_start_detection():
     if detector.start_detection():